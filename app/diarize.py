@@ -1,7 +1,10 @@
+import torch
 from pyannote.audio import Pipeline
 import os
 from dotenv import load_dotenv
 from pathlib import Path
+from embeddings import enable_fast_embeddings
+from pipeline import get_device, load_audio
 
 ROOT_FOLDER = Path(__file__).parent.parent
 INPUT_FOLDER = "input"
@@ -23,12 +26,14 @@ diarization_output_path = os.path.join(
 pipeline = Pipeline.from_pretrained(
     "pyannote/speaker-diarization-3.1", use_auth_token=os.getenv("HF_TOKEN")
 )
+enable_fast_embeddings(pipeline)
 
-# import torch
-# pipeline.to(torch.device("cuda"))
+pipeline.to(torch.device(get_device()))
 
-# run the pipeline on an audio file
-diarization = pipeline(audio_file_path)
+# run the pipeline on the decoded waveform so chunks are sliced in memory
+y, sr = load_audio(audio_file_path)
+audio_in = {"waveform": torch.from_numpy(y).unsqueeze(0), "sample_rate": sr}
+diarization = pipeline(audio_in)
 
 print("\n--- Speaker Diarization ---")
 for turn, _, speaker in diarization.itertracks(yield_label=True):
@@ -0,0 +1,137 @@
+import functools
+import math
+import types
+import warnings
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from pyannote.audio.pipelines import SpeakerDiarization
+
+
+def enable_fast_embeddings(diarization_pipeline, precision=torch.float32):
+    """Switch a diarization pipeline to the batched embedding extraction below
+
+    `precision` is the autocast dtype for the frame features, e.g. torch.float16
+    on GPU; pooling always runs in fp32.
+    """
+    diarization_pipeline.get_embeddings = types.MethodType(
+        functools.partial(get_embeddings, precision=precision), diarization_pipeline
+    )
+    return diarization_pipeline
+
+
+def get_embeddings(
+    self,
+    file,
+    binary_segmentations,
+    exclude_overlap=False,
+    hook=None,
+    precision=torch.float32,
+):
+    """Extract embeddings for each (chunk, speaker) pair, batched by chunk
+
+    Drop-in replacement for SpeakerDiarization.get_embeddings: chunks are sliced
+    from the in-memory waveform, frame-level features are computed once per
+    chunk and only the pooling runs per speaker. Pairs where the speaker is
+    never active are left as NaN, which clustering already skips. Falls back to
+    the original when the audio is not a waveform or the model is not WeSpeaker.
+    """
+    model = self._embedding.model_
+    waveform = file.get("waveform")
+    if (
+        self.training
+        or waveform is None
+        or waveform.shape[0] != 1
+        or file.get("sample_rate") != self._embedding.sample_rate
+        or not hasattr(model, "forward_frames")
+    ):
+        return SpeakerDiarization.get_embeddings(
+            self,
+            file,
+            binary_segmentations,
+            exclude_overlap=exclude_overlap,
+            hook=hook,
+        )
+
+    duration = binary_segmentations.sliding_window.duration
+    num_chunks, num_frames, num_speakers = binary_segmentations.data.shape
+    sample_rate = self._embedding.sample_rate
+    num_samples = math.floor(duration * sample_rate)
+
+    # mask may contain NaN (in case of partial stitching)
+    masks = np.nan_to_num(binary_segmentations.data, nan=0.0).astype(np.float32)
+    if exclude_overlap:
+        # minimum number of frames needed to extract an embedding
+        min_num_frames = math.ceil(
+            num_frames * self._embedding.min_num_samples / (duration * sample_rate)
+        )
+
+        # zero-out frames with overlapping speech, unless too little is left
+        clean_frames = np.sum(binary_segmentations.data, axis=2, keepdims=True) < 2
+        clean_masks = np.nan_to_num(
+            binary_segmentations.data * clean_frames, nan=0.0
+        ).astype(np.float32)
+        use_clean = np.sum(clean_masks, axis=1, keepdims=True) > min_num_frames
+        masks = np.where(use_clean, clean_masks, masks)
+
+    # (chunk, speaker) pairs where the speaker is never active
+    active = np.sum(masks, axis=1) > 0
+
+    # Pad the end once so every chunk is a plain slice of the waveform
+    padded = F.pad(waveform, (0, num_samples))
+    chunk_starts = [
+        math.floor(binary_segmentations.sliding_window[c].start * sample_rate)
+        for c in range(num_chunks)
+    ]
+
+    device = self._embedding.device
+    embeddings = np.full(
+        (num_chunks, num_speakers, self._embedding.dimension), np.nan, dtype=np.float32
+    )
+
+    batch_size = self.embedding_batch_size
+    batch_count = math.ceil(num_chunks / batch_size)
+    if hook is not None:
+        hook("embeddings", None, total=batch_count, completed=0)
+
+    for i, batch_start in enumerate(range(0, num_chunks, batch_size), 1):
+        chunks = np.arange(batch_start, min(batch_start + batch_size, num_chunks))
+        chunks = chunks[active[chunks].any(axis=1)]
+        if len(chunks) > 0:
+            waveforms = torch.stack(
+                [
+                    padded[:, chunk_starts[c] : chunk_starts[c] + num_samples]
+                    for c in chunks
+                ]
+            ).to(device)
+            # (batch_size, 1, num_samples) torch.Tensor
+
+            weights = torch.from_numpy(
+                np.ascontiguousarray(masks[chunks].transpose(0, 2, 1))
+            ).to(device)
+            # (batch_size, num_speakers, num_frames) torch.Tensor
+
+            with torch.inference_mode(), warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                with torch.autocast(
+                    device_type=device.type,
+                    dtype=precision,
+                    enabled=precision != torch.float32,
+                ):
+                    frames = model.forward_frames(waveforms)
+                # pooling stays in fp32 for numerical stability
+                embedding_batch = model.forward_embedding(
+                    frames.float(), weights=weights
+                )
+                # (batch_size, num_speakers, dimension) torch.Tensor
+
+            embedding_batch = embedding_batch.float().cpu().numpy()
+            embeddings[chunks] = np.where(
+                active[chunks][..., None], embedding_batch, np.nan
+            )
+
+        if hook is not None:
+            hook("embeddings", None, total=batch_count, completed=i)
+
+    return embeddings
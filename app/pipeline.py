@@ -0,0 +1,253 @@
+import bisect
+
+import numpy as np
+import soundfile as sf
+import soxr
+import torch
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+
+WHISPER_MODEL = "base"
+SAMPLE_RATE = 16000  # Whisper works best with 16kHz audio
+BATCH_SIZE = 16
+CPU_THREADS = 4
+MAX_CLIP_SECONDS = 30  # Whisper only sees 30 seconds of audio per window
+MIN_TURN_SECONDS = 0.3  # shorter turns are skipped rather than transcribed
+SILENCE_RMS = 1e-3  # turns quieter than this are treated as silence
+MERGE_GAP_SECONDS = 0.3  # same-speaker turns closer than this are merged
+PACK_GAP_SECONDS = 0.1  # silence between turns packed into the same window
+SPLIT_SEARCH_SECONDS = 2  # how far before a window boundary to look for a pause
+SPLIT_FRAME_SECONDS = 0.02  # energy resolution when looking for a pause
+
+# fp16 on GPU, int8 weights on CTranslate2's quantized GEMM kernels on CPU
+COMPUTE_TYPES = {"cuda": "float16", "cpu": "int8"}
+
+
+def get_device():
+    """Use the GPU when one is available, otherwise fall back to the CPU"""
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def transcription_config(device):
+    """Settings that change the transcript produced for the same audio"""
+    return {
+        "model": WHISPER_MODEL,
+        "compute_type": COMPUTE_TYPES[device],
+        "batch_size": BATCH_SIZE,
+        "max_clip_seconds": MAX_CLIP_SECONDS,
+        "min_turn_seconds": MIN_TURN_SECONDS,
+        "silence_rms": SILENCE_RMS,
+        "merge_gap_seconds": MERGE_GAP_SECONDS,
+        "pack_gap_seconds": PACK_GAP_SECONDS,
+        "split_search_seconds": SPLIT_SEARCH_SECONDS,
+        "split_frame_seconds": SPLIT_FRAME_SECONDS,
+    }
+
+
+def load_audio(audio_file, sample_rate=SAMPLE_RATE):
+    """Decode an audio file path or file object to a mono float32 waveform"""
+    data, native_rate = sf.read(audio_file, dtype="float32", always_2d=False)
+    if data.ndim > 1:
+        data = data.mean(axis=1)
+    if native_rate != sample_rate:
+        data = soxr.resample(data, native_rate, sample_rate)
+    return data, sample_rate
+
+
+def load_transcription_model(device="cpu"):
+    """Load the Whisper model wrapped for batched inference"""
+    model = WhisperModel(
+        WHISPER_MODEL,
+        device=device,
+        compute_type=COMPUTE_TYPES[device],
+        cpu_threads=CPU_THREADS,
+    )
+    return BatchedInferencePipeline(model=model)
+
+
+def warmup_transcription_model(batched_model, sample_rate=SAMPLE_RATE):
+    """Run one silent window through Whisper so its first real call is fast"""
+    silence = np.zeros(MAX_CLIP_SECONDS * sample_rate, dtype=np.float32)
+    results, _ = batched_model.transcribe(
+        silence,
+        batch_size=1,
+        vad_filter=False,
+        clip_timestamps=[{"start": 0, "end": len(silence)}],
+    )
+    list(results)  # results are decoded lazily
+
+
+def format_segment(segment):
+    """Format a segment as a timestamped, speaker-labeled transcript line"""
+    return (
+        f"[{segment['start']:.2f}s --> {segment['end']:.2f}s] "
+        f"{segment['speaker']}: {segment['text']}"
+    )
+
+
+def merge_turns(turns, max_gap=MERGE_GAP_SECONDS):
+    """Merge consecutive turns of the same speaker separated by less than `max_gap`"""
+    merged = []
+    for start_time, end_time, speaker in turns:
+        if merged and merged[-1][2] == speaker and start_time - merged[-1][1] < max_gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end_time), speaker)
+        else:
+            merged.append((start_time, end_time, speaker))
+    return merged
+
+
+def is_voiced(segment, sample_rate=SAMPLE_RATE):
+    """Check whether a waveform slice is long and loud enough to transcribe"""
+    if len(segment) < MIN_TURN_SECONDS * sample_rate:
+        return False
+    return np.sqrt(np.mean(np.square(segment))) >= SILENCE_RMS
+
+
+def split_turn(audio, start_sample, end_sample, max_samples, sample_rate=SAMPLE_RATE):
+    """Split a turn into clips of at most `max_samples`, cutting at pauses
+
+    Each cut is placed at the quietest frame within the last
+    SPLIT_SEARCH_SECONDS before the window limit, so words are not sliced in
+    half. Returns a list of (start, end) sample indices.
+    """
+    frame = max(1, int(SPLIT_FRAME_SECONDS * sample_rate))
+    search = min(int(SPLIT_SEARCH_SECONDS * sample_rate), max_samples) // frame * frame
+    end_sample = min(end_sample, len(audio))
+    clips = []
+    clip_start = start_sample
+    while end_sample - clip_start > max_samples:
+        limit = clip_start + max_samples
+        frames = audio[limit - search : limit].reshape(-1, frame)
+        quietest = int(np.argmin(np.mean(np.square(frames), axis=1)))
+        # Cut in the middle of the quietest frame
+        cut = limit - search + quietest * frame + frame // 2
+        clips.append((clip_start, cut))
+        clip_start = cut
+    clips.append((clip_start, end_sample))
+    return clips
+
+
+def is_duplicate_word(kept, start, end, text, turn):
+    """Check whether an overlapping turn already produced the same word
+
+    `kept` holds the (start, end, text, turn index) tuples accepted so far, in
+    seconds of the original audio and sorted by start time.
+    """
+    for kept_start, kept_end, kept_text, kept_turn in reversed(kept):
+        # No word spans more than one window, so older ones cannot overlap
+        if kept_start < start - MAX_CLIP_SECONDS:
+            return False
+        if (
+            kept_turn != turn
+            and kept_start < end
+            and start < kept_end
+            and kept_text.strip().lower() == text.strip().lower()
+        ):
+            return True
+    return False
+
+
+def iter_transcribed_turns(batched_model, audio, turns, sample_rate=SAMPLE_RATE):
+    """Transcribe all diarization turns with a single batched Whisper call
+
+    `turns` is a list of (start, end, speaker) tuples in seconds and `audio` the
+    mono waveform they refer to. Consecutive same-speaker turns are merged first
+    and one segment dict is yielded per merged turn, in order, as soon as every
+    window it was packed into has been decoded. Turns that are too short or
+    silent are not sent to Whisper and come back with empty text.
+
+    Whisper pays a full encoder pass per 30s window however short the input, so
+    voiced turns are packed back to back into shared windows and the decoded
+    words are mapped back to their turns through the packing offsets.
+    """
+    turns = merge_turns(turns)
+    max_samples = MAX_CLIP_SECONDS * sample_rate
+    # Convert all turn boundaries to sample indices in one vectorized pass
+    bounds = np.array([turn[:2] for turn in turns], dtype=np.float64).reshape(-1, 2)
+    sample_bounds = (bounds * sample_rate).astype(np.int64).tolist()
+
+    # Skip turns that would only cost Whisper a window to decode nothing
+    voiced = np.array(
+        [is_voiced(audio[start:end], sample_rate) for start, end in sample_bounds],
+        dtype=bool,
+    )
+
+    # Concatenate voiced turns with a short silence between them and greedily
+    # fill windows of at most 30s, splitting turns longer than a window at
+    # their quietest point near the limit. Each piece records (packed start,
+    # original start, turn index), and last_window the window holding the end
+    # of each turn (-1 if skipped).
+    gap = np.zeros(int(PACK_GAP_SECONDS * sample_rate), dtype=audio.dtype)
+    chunks = []
+    pieces = []
+    windows = []
+    last_window = [-1] * len(turns)
+    packed_length = 0
+    for i in np.flatnonzero(voiced):
+        start_sample, end_sample = sample_bounds[i]
+        for clip_start, clip_end in split_turn(
+            audio, start_sample, end_sample, max_samples, sample_rate
+        ):
+            clip_length = clip_end - clip_start
+            window_end = packed_length + len(gap) + clip_length
+            if windows and window_end - windows[-1]["start"] <= max_samples:
+                chunks.append(gap)
+                packed_length += len(gap)
+                windows[-1]["end"] = window_end
+            else:
+                windows.append(
+                    {"start": packed_length, "end": packed_length + clip_length}
+                )
+            pieces.append((packed_length, clip_start, int(i)))
+            chunks.append(audio[clip_start : clip_start + clip_length])
+            packed_length += clip_length
+        last_window[i] = len(windows) - 1
+
+    words = [[] for _ in turns]
+
+    def segment(i):
+        start_time, end_time, speaker = turns[i]
+        return {
+            "start": start_time,
+            "end": end_time,
+            "speaker": speaker,
+            "text": "".join(words[i]).strip(),
+        }
+
+    next_turn = 0
+    if windows:
+        results, _ = batched_model.transcribe(
+            np.concatenate(chunks),
+            batch_size=BATCH_SIZE,
+            word_timestamps=True,
+            vad_filter=False,
+            clip_timestamps=windows,
+        )
+
+        window_starts = np.array([window["start"] for window in windows]) / sample_rate
+        piece_starts = np.array([piece[0] for piece in pieces]) / sample_rate
+        kept = []
+        for result in results:
+            # Results arrive in window order, so turns ending in earlier
+            # windows are complete
+            midpoint = (result.start + result.end) / 2
+            window = np.searchsorted(window_starts, midpoint, side="right") - 1
+            while next_turn < len(turns) and last_window[next_turn] < window:
+                yield segment(next_turn)
+                next_turn += 1
+
+            # Find the piece each word was decoded from and shift its
+            # timestamps back to the original audio
+            for word in result.words or []:
+                midpoint = (word.start + word.end) / 2
+                index = np.searchsorted(piece_starts, midpoint, side="right") - 1
+                packed_start, original_start, turn = pieces[max(index, 0)]
+                offset = (original_start - packed_start) / sample_rate
+                start, end = word.start + offset, word.end + offset
+                if not is_duplicate_word(kept, start, end, word.word, turn):
+                    # Words arrive in packing order, not time order
+                    bisect.insort(kept, (start, end, word.word, turn))
+                    words[turn].append(word.word)
+
+    while next_turn < len(turns):
+        yield segment(next_turn)
+        next_turn += 1
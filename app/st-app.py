@@ -1,20 +1,175 @@
 import streamlit as st
 import torch
 from pyannote.audio import Pipeline
-import whisper
-import librosa
 import os
 from dotenv import load_dotenv
 from pathlib import Path
+import io
+import hashlib
+import pickle
+import struct
 import tempfile
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import io
-import soundfile as sf
+from embeddings import enable_fast_embeddings
+from pipeline import (
+    SAMPLE_RATE,
+    format_segment,
+    get_device,
+    iter_transcribed_turns,
+    load_audio,
+    load_transcription_model,
+    transcription_config,
+    warmup_transcription_model,
+)
 
 # Setup
 ROOT_FOLDER = Path(__file__).parent.parent
 load_dotenv(ROOT_FOLDER / ".env")
 
+DIARIZATION_MODEL = "pyannote/speaker-diarization-3.1"
+CACHE_FOLDER = Path.home() / ".cache" / "learn-transcription"
+# Bump when a change to the pipeline code alters results for the same settings
+CACHE_VERSION = 1
+
+# Speaker colors
+SPEAKER_COLORS = {
+    "SPEAKER_00": "#FF6B6B",  # Red
+    "SPEAKER_01": "#4ECDC4",  # Teal
+    "SPEAKER_02": "#45B7D1",  # Blue
+    "SPEAKER_03": "#96CEB4",  # Green
+    "SPEAKER_04": "#FFEAA7",  # Yellow
+    "SPEAKER_05": "#DDA0DD",  # Plum
+    "SPEAKER_06": "#FFB347",  # Peach
+    "SPEAKER_07": "#98FB98",  # Pale Green
+}
+
+# One CSS class per speaker, e.g. SPEAKER_03 -> spk-03
+SPEAKER_CLASSES = {speaker: f"spk-{speaker[-2:]}" for speaker in SPEAKER_COLORS}
+
+# Segment styles are emitted once per render instead of inlined in every segment;
+# speakers without a color keep the grey defaults
+SEGMENT_CSS = (
+    "<style>"
+    ".segment{background-color:#DDDDDD22;padding:15px;margin:10px 0;"
+    "border-radius:8px;border-left:5px solid #DDD}"
+    ".segment .speaker{color:#DDD;font-weight:bold;margin-bottom:8px}"
+    ".segment .text{color:#333;font-size:1.1em;line-height:1.4}"
+    + "".join(
+        f".{SPEAKER_CLASSES[speaker]}{{background-color:{color}22;"
+        f"border-left-color:{color}}}"
+        f".{SPEAKER_CLASSES[speaker]} .speaker{{color:{color}}}"
+        for speaker, color in SPEAKER_COLORS.items()
+    )
+    + "</style>"
+)
+
+
+def config_tag(config):
+    """Short hash of a settings dict, to key cache entries on the exact config"""
+    config = {**config, "cache_version": CACHE_VERSION}
+    encoded = repr(sorted(config.items())).encode()
+    return hashlib.blake2b(encoded, digest_size=4).hexdigest()
+
+
+def load_cached(key):
+    """Load a result from the on-disk cache, or None if it is not there"""
+    cache_path = CACHE_FOLDER / f"{key}.pkl"
+    if not cache_path.exists():
+        return None
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        # A damaged or unreadable entry is a miss; drop it so it is rebuilt
+        cache_path.unlink(missing_ok=True)
+        return None
+
+
+def save_cached(key, value):
+    """Store a result in the on-disk cache"""
+    CACHE_FOLDER.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file and rename it into place, so an interrupted
+    # run never leaves a truncated entry behind
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=CACHE_FOLDER, suffix=".tmp", delete=False
+    ) as f:
+        pickle.dump(value, f)
+    os.replace(f.name, CACHE_FOLDER / f"{key}.pkl")
+
+
+def load_diarization_pipeline(hf_token, device):
+    """Load, compile and warm up the diarization pipeline"""
+    diarization_pipeline = Pipeline.from_pretrained(
+        DIARIZATION_MODEL, use_auth_token=hf_token
+    )
+    # Run embedding frames in fp16 on GPU; the CPU path stays fp32
+    precision = torch.float16 if device == "cuda" else torch.float32
+    enable_fast_embeddings(diarization_pipeline, precision=precision)
+    diarization_pipeline.to(torch.device(device))
+
+    # Compile and warm up here, so the compile cost is cached with the
+    # pipeline instead of hitting the first upload
+    compile_diarization_models(diarization_pipeline, precision)
+    return diarization_pipeline
+
+
+def compile_diarization_models(diarization_pipeline, precision=torch.float32):
+    """Compile the segmentation model and the embedding frame features
+
+    Falls back to the eager models when compilation fails, e.g. on platforms
+    without a working compiler toolchain.
+    """
+    segmentation = diarization_pipeline._segmentation
+    embedding_model = diarization_pipeline._embedding.model_
+    eager_segmentation = segmentation.model
+    try:
+        # dynamic=True so the smaller last batch of a file does not recompile
+        segmentation.model = torch.compile(
+            eager_segmentation, mode="reduce-overhead", dynamic=True
+        )
+        # The batched get_embeddings calls forward_frames directly, which a
+        # compiled module would forward to the eager one, so compile the
+        # method itself. Pooling per speaker is cheap and stays eager.
+        if hasattr(embedding_model, "forward_frames"):
+            embedding_model.forward_frames = torch.compile(
+                embedding_model.forward_frames, mode="reduce-overhead", dynamic=True
+            )
+
+        # Call the models directly on full batches of noise: running the
+        # pipeline on silence stops before any embedding is extracted, and
+        # a short file never fills a batch
+        chunk = 0.1 * torch.randn(1, 1, int(segmentation.duration * SAMPLE_RATE))
+        with torch.inference_mode():
+            segmentation.model(
+                chunk.expand(segmentation.batch_size, -1, -1).to(segmentation.device)
+            )
+            if "forward_frames" in vars(embedding_model):
+                # Same autocast as get_embeddings, so the traced graph is reused
+                device = diarization_pipeline._embedding.device
+                with torch.autocast(
+                    device_type=device.type,
+                    dtype=precision,
+                    enabled=precision != torch.float32,
+                ):
+                    embedding_model.forward_frames(
+                        chunk.expand(
+                            diarization_pipeline.embedding_batch_size, -1, -1
+                        ).to(device)
+                    )
+    except Exception as e:
+        warnings.warn(f"torch.compile failed, using eager diarization models: {e}")
+        segmentation.model = eager_segmentation
+        vars(embedding_model).pop("forward_frames", None)
+
+
+def load_warm_transcription_model(device):
+    """Load and warm up the transcription model"""
+    transcription_model = load_transcription_model(device=device)
+    warmup_transcription_model(transcription_model)
+    return transcription_model
+
 
 @st.cache_resource
 def load_models():
@@ -26,132 +181,129 @@ def load_models():
         )
         st.stop()
 
-    device = "cpu"
-    torch.set_num_threads(4)
+    device = get_device()
 
-    # Load models
-    diarization_pipeline = Pipeline.from_pretrained(
-        "pyannote/speaker-diarization-3.1", use_auth_token=hf_token
-    )
-    transcription_model = whisper.load_model("base", device=device)
+    # The models are independent, so download and warm them up concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        diarization_future = executor.submit(
+            load_diarization_pipeline, hf_token, device
+        )
+        transcription_future = executor.submit(load_warm_transcription_model, device)
+        diarization_pipeline = diarization_future.result()
+        transcription_model = transcription_future.result()
 
     return diarization_pipeline, transcription_model
 
 
-@st.cache_data
-def process_audio(_diarization_pipeline, _transcription_model, audio_path):
-    """Process audio file for diarization and transcription - cached to prevent reprocessing"""
-
-    # Perform diarization
-    with st.spinner("Performing speaker diarization..."):
-        diarization = _diarization_pipeline(audio_path)
-
-    # Load audio for transcription
-    with st.spinner("Loading audio for transcription..."):
-        y, sr = librosa.load(audio_path, sr=16000)
-
-    # Process each segment
+def process_audio(diarization_pipeline, transcription_model, y, sr, audio_hash):
+    """Process audio for diarization and transcription, yielding segments as they finish
+
+    Results are cached on disk, keyed on the audio content hash and the model
+    configuration, so processing the same file again replays them straight away.
+    """
+    device = get_device()
+    diarization_tag = config_tag({"model": DIARIZATION_MODEL, "device": device})
+    transcription_tag = config_tag(transcription_config(device))
+    result_key = f"{audio_hash}-{diarization_tag}-{transcription_tag}-segments"
+    cached_segments = load_cached(result_key)
+    if cached_segments is not None:
+        yield from cached_segments
+        return
+
+    # Diarization is cached on its own so it is reused when only Whisper changes
+    diarization_key = f"{audio_hash}-{diarization_tag}"
+    turns = load_cached(diarization_key)
+    if turns is None:
+        # Perform diarization on the in-memory waveform to skip per-chunk file reads
+        with st.spinner("Performing speaker diarization..."):
+            audio_in = {"waveform": torch.from_numpy(y).unsqueeze(0), "sample_rate": sr}
+            diarization = diarization_pipeline(audio_in)
+
+        turns = [
+            (turn.start, turn.end, speaker)
+            for turn, _, speaker in diarization.itertracks(yield_label=True)
+        ]
+        save_cached(diarization_key, turns)
+
+    # Transcribe all turns in one batched call, passing segments on as they finish
     segments = []
-    total_segments = len(list(diarization.itertracks()))
-    progress_bar = st.progress(0)
-
     with st.spinner("Transcribing segments..."):
-        for i, (turn, _, speaker) in enumerate(
-            diarization.itertracks(yield_label=True)
+        for segment in iter_transcribed_turns(
+            transcription_model, y, turns, sample_rate=sr
         ):
-            start_time = turn.start
-            end_time = turn.end
-
-            # Extract audio segment
-            start_sample = int(start_time * sr)
-            end_sample = int(end_time * sr)
-            segment = y[start_sample:end_sample]
-
-            # Transcribe segment
-            result = _transcription_model.transcribe(segment, fp16=False)
-
-            # Only add segments with meaningful text content
-            transcribed_text = result["text"].strip()
-            if transcribed_text:  # Only append if text is not empty
-                segments.append(
-                    {
-                        "start": start_time,
-                        "end": end_time,
-                        "speaker": speaker,
-                        "text": transcribed_text,
-                    }
-                )
-
-            # Update progress
-            progress_bar.progress((i + 1) / total_segments)
-
-    progress_bar.empty()
-    return segments, y.tolist(), sr  # Convert numpy array to list for caching
-
-
-def create_audio_bytes(audio_data, sample_rate):
-    """Create properly formatted audio bytes for streamlit"""
-    # Convert list back to numpy array if needed
-    if isinstance(audio_data, list):
-        audio_data = np.array(audio_data)
-
-    # Create a BytesIO buffer
-    buffer = io.BytesIO()
+            # Only keep segments with meaningful text content
+            if segment["text"]:
+                segments.append(segment)
+                yield segment
+
+    save_cached(result_key, segments)
+
+
+@st.cache_data(max_entries=1)  # only the current upload is played back
+def create_audio_bytes(_audio_data, sample_rate, audio_hash):
+    """Create properly formatted audio bytes for streamlit
+
+    The audio is packed as 16-bit PCM with NumPy behind a minimal 44-byte WAV
+    header. Results are cached on the audio hash so reruns reuse them.
+    """
+    pcm = np.clip(_audio_data * 32767.0, -32768, 32767).astype("<i2")
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + pcm.nbytes,
+        b"WAVE",
+        b"fmt ",
+        16,  # fmt chunk size
+        1,  # PCM
+        1,  # mono
+        sample_rate,
+        sample_rate * 2,  # byte rate
+        2,  # block align
+        16,  # bits per sample
+        b"data",
+        pcm.nbytes,
+    )
+    return header + pcm.tobytes()
+
+
+def segment_html(segment):
+    """Build the HTML block for a single transcribed segment, styled by SEGMENT_CSS"""
+    speaker_class = SPEAKER_CLASSES.get(segment["speaker"], "")
+    return (
+        f'<div class="segment {speaker_class}">'
+        f'<div class="speaker">{segment["speaker"]} '
+        f"({segment['start']:.1f}s - {segment['end']:.1f}s)</div>"
+        f'<div class="text">{segment["text"]}</div>'
+        "</div>\n"
+    )
 
-    # Write audio data to buffer as WAV
-    sf.write(buffer, audio_data, sample_rate, format="WAV")
 
-    # Get bytes from buffer
-    buffer.seek(0)
-    return buffer.getvalue()
+def render_segment(segment):
+    """Display a single transcribed segment with its speaker color"""
+    st.markdown(segment_html(segment), unsafe_allow_html=True)
 
 
-def display_transcription_with_audio(segments, audio_data, sample_rate):
+def display_transcription_with_audio(segments, audio_data, sample_rate, audio_hash):
     """Display transcription with audio player and simple text view"""
 
     # Create audio player
     st.subheader("🎵 Audio Player")
-    audio_bytes = create_audio_bytes(audio_data, sample_rate)
+    audio_bytes = create_audio_bytes(audio_data, sample_rate, audio_hash)
     st.audio(audio_bytes, format="audio/wav")
 
     # Display simple transcription
     st.subheader("📝 Transcription")
 
-    # Speaker colors
-    speaker_colors = {
-        "SPEAKER_00": "#FF6B6B",  # Red
-        "SPEAKER_01": "#4ECDC4",  # Teal
-        "SPEAKER_02": "#45B7D1",  # Blue
-        "SPEAKER_03": "#96CEB4",  # Green
-        "SPEAKER_04": "#FFEAA7",  # Yellow
-        "SPEAKER_05": "#DDA0DD",  # Plum
-        "SPEAKER_06": "#FFB347",  # Peach
-        "SPEAKER_07": "#98FB98",  # Pale Green
-    }
-
-    # Display each segment with speaker colors
-    for segment in segments:
-        speaker_color = speaker_colors.get(segment["speaker"], "#DDD")
-
-        st.markdown(
-            f"""
-        <div style="
-            background-color: {speaker_color}22; 
-            padding: 15px; 
-            margin: 10px 0; 
-            border-radius: 8px; 
-            border-left: 5px solid {speaker_color};
-        ">
-            <div style="color: {speaker_color}; font-weight: bold; margin-bottom: 8px;">
-                {segment['speaker']} ({segment['start']:.1f}s - {segment['end']:.1f}s)
-            </div>
-            <div style="color: #333; font-size: 1.1em; line-height: 1.4;">
-                {segment['text']}
-            </div>
-        </div>
-        """,
-            unsafe_allow_html=True,
-        )
+    # Render all segments in a single markdown element instead of one per
+    # segment, in a scrollable box so long transcripts don't reflow the page
+    html_parts = [segment_html(segment) for segment in segments]
+    st.markdown(
+        SEGMENT_CSS
+        + '<div style="max-height: 600px; overflow: auto;">\n'
+        + "".join(html_parts)
+        + "</div>",
+        unsafe_allow_html=True,
+    )
 
 
 def main():
@@ -173,6 +325,10 @@ def main():
         st.session_state.processed_sample_rate = None
     if "processed_file_name" not in st.session_state:
         st.session_state.processed_file_name = None
+    if "processed_audio_hash" not in st.session_state:
+        st.session_state.processed_audio_hash = None
+    if "processed_transcript" not in st.session_state:
+        st.session_state.processed_transcript = None
 
     # Sidebar for settings
     with st.sidebar:
@@ -214,40 +370,58 @@ def main():
                     st.session_state.processed_audio_data = None
                     st.session_state.processed_sample_rate = None
                     st.session_state.processed_file_name = None
+                    st.session_state.processed_audio_hash = None
+                    st.session_state.processed_transcript = None
                     st.rerun()
 
         # Process audio when button is clicked
         if process_button:
-            # Save uploaded file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_path = tmp_file.name
+            audio_bytes = uploaded_file.getvalue()
+            audio_hash = hashlib.blake2b(audio_bytes, digest_size=16).hexdigest()
 
             try:
-                # Process the audio
-                segments, audio_data, sample_rate = process_audio(
-                    diarization_pipeline, transcription_model, tmp_path
-                )
+                # Decode the upload straight from memory, once for diarization,
+                # transcription and playback
+                with st.spinner("Loading audio..."):
+                    audio_data, sample_rate = load_audio(io.BytesIO(audio_bytes))
+
+                # Show segments as they are transcribed; the full results view
+                # below replaces this once processing is done
+                live_view = st.empty()
+                segments = []
+                transcript_lines = []
+                with live_view.container():
+                    st.subheader("📝 Transcription")
+                    st.markdown(SEGMENT_CSS, unsafe_allow_html=True)
+                    for segment in process_audio(
+                        diarization_pipeline,
+                        transcription_model,
+                        audio_data,
+                        sample_rate,
+                        audio_hash,
+                    ):
+                        render_segment(segment)
+                        segments.append(segment)
+                        transcript_lines.append(format_segment(segment))
+                live_view.empty()
 
                 # Store in session state
                 st.session_state.processed_segments = segments
                 st.session_state.processed_audio_data = audio_data
                 st.session_state.processed_sample_rate = sample_rate
                 st.session_state.processed_file_name = uploaded_file.name
+                st.session_state.processed_audio_hash = audio_hash
+                st.session_state.processed_transcript = "\n".join(transcript_lines)
 
             except Exception as e:
                 st.error(f"❌ Error processing audio: {str(e)}")
 
-            finally:
-                # Clean up temporary file
-                if os.path.exists(tmp_path):
-                    os.unlink(tmp_path)
-
         # Display results if they exist in session state
         if st.session_state.processed_segments is not None:
             segments = st.session_state.processed_segments
             audio_data = st.session_state.processed_audio_data
             sample_rate = st.session_state.processed_sample_rate
+            audio_hash = st.session_state.processed_audio_hash
 
             if segments:
                 st.success(
@@ -255,19 +429,14 @@ def main():
                 )
 
                 # Display results with interactive features
-                display_transcription_with_audio(segments, audio_data, sample_rate)
-
-                # Download button for transcription
-                transcription_text = "\n".join(
-                    [
-                        f"[{seg['start']:.2f}s --> {seg['end']:.2f}s] {seg['speaker']}: {seg['text']}"
-                        for seg in segments
-                    ]
+                display_transcription_with_audio(
+                    segments, audio_data, sample_rate, audio_hash
                 )
 
+                # Download button for transcription, built once while processing
                 st.download_button(
                     label="📥 Download Transcription",
-                    data=transcription_text,
+                    data=st.session_state.processed_transcript,
                     file_name=f"transcription_{st.session_state.processed_file_name}.txt",
                     mime="text/plain",
                 )
@@ -1,7 +1,8 @@
-import whisper
+from faster_whisper import WhisperModel
 import json
 from pathlib import Path
 import os
+from pipeline import COMPUTE_TYPES, CPU_THREADS, WHISPER_MODEL, get_device
 
 ROOT_FOLDER = Path(__file__).parent.parent
 INPUT_FOLDER = "input"
@@ -15,23 +16,37 @@ audio_file_path = os.path.join(ROOT_FOLDER, INPUT_FOLDER, audio_input_filename)
 transcription_output_path = os.path.join(
     ROOT_FOLDER, OUTPUT_FOLDER, transcription_output_filename
 )
-# Force CPU to prevent the CUDA error you saw before
-device = "cpu"
+# Use the GPU when available, otherwise fall back to the CPU
+device = get_device()
 
 # check if output folder exists, if not create it
 if not os.path.exists(os.path.join(ROOT_FOLDER, OUTPUT_FOLDER)):
     os.makedirs(os.path.join(ROOT_FOLDER, OUTPUT_FOLDER))
 
 # --- Part 2: Load the Model ---
-print("Loading Whisper model (base)...")
-# Using "base" model. Other options: "tiny", "small", "medium", "large"
-model = whisper.load_model("base", device=device)
+print(f"Loading Whisper model ({WHISPER_MODEL})...")
+# Same settings as the app. Other options: "tiny", "small", "medium", "large"
+model = WhisperModel(
+    WHISPER_MODEL,
+    device=device,
+    compute_type=COMPUTE_TYPES[device],
+    cpu_threads=CPU_THREADS,
+)
 print("Model loaded.")
 
 # --- Part 3: Transcribe the Audio ---
 print(f"\nTranscribing {audio_file_path}...")
-# The transcribe function does all the work
-result = model.transcribe(audio_file_path)
+# The transcribe function does all the work; segments are decoded lazily
+segments, info = model.transcribe(audio_file_path)
+segments = [
+    {"id": segment.id, "start": segment.start, "end": segment.end, "text": segment.text}
+    for segment in segments
+]
+result = {
+    "text": "".join(segment["text"] for segment in segments),
+    "segments": segments,
+    "language": info.language,
+}
 print("Transcription complete.")
 
 # --- Part 4: Print the Results ---
@@ -0,0 +1,116 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+import pipeline
+from pipeline import MAX_CLIP_SECONDS, iter_transcribed_turns, merge_turns, split_turn
+
+SAMPLE_RATE = 16000
+DURATION = 100  # seconds of test audio
+
+
+def make_audio(silent=()):
+    """A ramp whose value encodes the original sample index, zeroed on `silent`"""
+    num_samples = DURATION * SAMPLE_RATE
+    audio = (np.arange(num_samples, dtype=np.float64) + 1) / num_samples
+    audio = audio.astype(np.float32)
+    for start, end in silent:
+        audio[int(start * SAMPLE_RATE) : int(end * SAMPLE_RATE)] = 0
+    return audio
+
+
+class FakeWhisper:
+    """Stands in for BatchedInferencePipeline
+
+    Every whole second of the original audio is a word named after that second.
+    The original time is recovered from the ramp values, so a word only comes
+    back if the packed audio really holds that moment of the recording.
+    """
+
+    def __init__(self, num_samples):
+        self.num_samples = num_samples
+        self.windows = []
+
+    def transcribe(self, audio, clip_timestamps, **kwargs):
+        self.windows = clip_timestamps
+        return (self.decode(audio, window) for window in clip_timestamps), None
+
+    def decode(self, audio, window):
+        words = []
+        start, end = window["start"], window["end"]
+        voiced = np.concatenate([[False], audio[start:end] > 0, [False]])
+        edges = np.flatnonzero(np.diff(voiced.astype(np.int8)))
+        for run_start, run_end in zip(edges[::2] + start, edges[1::2] + start):
+            original_start = round(float(audio[run_start]) * self.num_samples) - 1
+            second = -(-original_start // SAMPLE_RATE)  # first whole second
+            while True:
+                packed = run_start + second * SAMPLE_RATE - original_start
+                word_end = packed + SAMPLE_RATE // 5
+                if word_end > run_end:
+                    break
+                words.append(
+                    SimpleNamespace(
+                        start=packed / SAMPLE_RATE,
+                        end=word_end / SAMPLE_RATE,
+                        word=f" {second}",
+                    )
+                )
+                second += 1
+        return SimpleNamespace(
+            start=start / SAMPLE_RATE, end=end / SAMPLE_RATE, words=words
+        )
+
+
+def test_split_turn_cuts_at_pause():
+    audio = np.full(70 * SAMPLE_RATE, 0.5, dtype=np.float32)
+    audio[int(29.0 * SAMPLE_RATE) : int(29.1 * SAMPLE_RATE)] = 0
+    clips = split_turn(audio, 0, 70 * SAMPLE_RATE, 30 * SAMPLE_RATE, SAMPLE_RATE)
+
+    assert clips[0][0] == 0 and clips[-1][1] == 70 * SAMPLE_RATE
+    assert all(end - start <= 30 * SAMPLE_RATE for start, end in clips)
+    assert 29.0 <= clips[0][1] / SAMPLE_RATE <= 29.1
+
+
+def test_iter_transcribed_turns(monkeypatch):
+    turns = [
+        (0.5, 5.0, "SPEAKER_00"),
+        (5.5, 6.0, "SPEAKER_01"),  # silent
+        (6.5, 45.0, "SPEAKER_00"),  # longer than a window
+        (44.0, 50.0, "SPEAKER_01"),  # overlaps the end of the previous turn
+        (50.5, 50.6, "SPEAKER_00"),  # too short
+        (52.0, 60.0, "SPEAKER_01"),
+    ]
+
+    # Record where each word is mapped back to in the original audio
+    mapped = []
+    is_duplicate_word = pipeline.is_duplicate_word
+
+    def spy(kept, start, end, text, turn):
+        mapped.append((start, text))
+        return is_duplicate_word(kept, start, end, text, turn)
+
+    monkeypatch.setattr(pipeline, "is_duplicate_word", spy)
+    audio = make_audio(silent=[(5.5, 6.0)])
+    model = FakeWhisper(len(audio))
+    segments = list(iter_transcribed_turns(model, audio, turns, SAMPLE_RATE))
+
+    assert model.windows
+    assert all(
+        window["end"] - window["start"] <= MAX_CLIP_SECONDS * SAMPLE_RATE
+        for window in model.windows
+    )
+
+    # One segment per merged turn, in input order, silent ones included
+    assert [(s["start"], s["end"], s["speaker"]) for s in segments] == merge_turns(
+        turns
+    )
+    assert all(abs(start - int(text)) < 1e-3 for start, text in mapped)
+
+    texts = [segment["text"] for segment in segments]
+    assert texts[0] == "1 2 3 4"
+    assert texts[1] == ""
+    # The word at 44s was heard by both overlapping turns and is kept once
+    assert texts[2] == " ".join(str(second) for second in range(7, 45))
+    assert texts[3] == " ".join(str(second) for second in range(45, 50))
+    assert texts[4] == ""
+    assert texts[5] == " ".join(str(second) for second in range(52, 60))